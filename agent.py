@@ -1,9 +1,18 @@
 import os
 import io
-from typing import List, Dict, Any
+import re
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, AsyncIterator, Iterator, Optional, Tuple, Union
 
 import streamlit as st
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
 
 # =========================
 # BASIC CONFIG
@@ -17,102 +26,691 @@ st.set_page_config(
 # =========================
 # HELPER: LOAD GEMINI
 # =========================
+GEMINI_API_ENDPOINT = "generativelanguage.googleapis.com"
+# Ping only while calls are in flight: idle pings more often than every
+# 5 minutes make the server answer GOAWAY "too_many_pings" and drop the channel.
+GRPC_KEEPALIVE_OPTIONS = [
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+]
+
+def keepalive_transport(transport_cls):
+    """
+    Wrap a gRPC transport class so its channel sends keepalive pings during
+    calls, so a dropped connection fails fast instead of hanging a stream.
+    """
+    class KeepaliveTransport(transport_cls):
+        @classmethod
+        def create_channel(cls, host, **kwargs):
+            kwargs["options"] = list(kwargs.get("options") or []) + GRPC_KEEPALIVE_OPTIONS
+            return super().create_channel(host, **kwargs)
+    return KeepaliveTransport
+
+async def _make_async_client(client_options: Dict[str, str]):
+    # grpc.aio channels bind to the running loop, so build this one on ours.
+    from google.ai.generativelanguage_v1beta.services.generative_service.transports import (
+        GenerativeServiceGrpcAsyncIOTransport,
+    )
+    return glm.GenerativeServiceAsyncClient(
+        client_options=client_options,
+        transport=keepalive_transport(GenerativeServiceGrpcAsyncIOTransport),
+    )
+
+@st.cache_resource(show_spinner=False)
 def init_gemini(api_key: str, model_name: str = "models/gemini-flash-latest"):
+    """
+    Build the model once per (api_key, model_name) and reuse it across reruns,
+    with its own keepalive gRPC channels (sync and asyncio) so the connection
+    is reused between turns instead of being re-established.
+    """
+    from google.ai.generativelanguage_v1beta.services.generative_service.transports import (
+        GenerativeServiceGrpcTransport,
+    )
     genai.configure(api_key=api_key)
     model = genai.GenerativeModel(model_name)
+    client_options = {"api_key": api_key, "api_endpoint": GEMINI_API_ENDPOINT}
+    # GenerativeModel has no public hook for its clients; these private
+    # attributes are why google-generativeai is pinned in requirements.txt.
+    model._client = glm.GenerativeServiceClient(
+        client_options=client_options,
+        transport=keepalive_transport(GenerativeServiceGrpcTransport),
+    )
+    model._async_client = run_async(_make_async_client(client_options))
     return model
 
+@st.cache_resource(show_spinner=False)
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """
+    One long-lived event loop on a daemon thread. Gemini's async gRPC client
+    binds to the loop it is first used on, so reruns must reuse this loop
+    rather than start a fresh one with asyncio.run().
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def run_async(coro):
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+# =========================
+# HELPER: OPTIONAL DEPENDENCIES
+# =========================
+# Heavy optional libraries (torch via sentence-transformers, FAISS, PDFium)
+# are imported on first use, never at startup, so the UI paints without
+# paying for them. Each loader caches its module, or None when the library
+# is not installed, so a missing package is only looked up once per process.
+@st.cache_resource(show_spinner=False)
+def _get_pdfium():
+    try:
+        import pypdfium2 as m
+    except ImportError:
+        return None
+    return m
+
+@st.cache_resource(show_spinner=False)
+def _get_pypdf2():
+    try:
+        import PyPDF2 as m
+    except ImportError:
+        return None
+    return m
+
+@st.cache_resource(show_spinner=False)
+def _get_faiss():
+    try:
+        import faiss as m
+    except ImportError:
+        return None
+    return m
+
+@st.cache_resource(show_spinner=False)
+def _get_sentence_transformers():
+    try:
+        import sentence_transformers as m
+    except ImportError:
+        return None
+    return m
+
+@st.cache_resource(show_spinner=False)
+def _get_tiktoken():
+    try:
+        import tiktoken as m
+    except ImportError:
+        return None
+    return m
+
+# =========================
+# HELPER: RESPONSE CACHE
+# =========================
+RESPONSE_CACHE_SIZE = 512
+RESPONSE_CACHE_DIR = os.path.expanduser("~/.genietalk_cache")
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache() -> Dict[str, Any]:
+    """
+    Process-wide reply cache that survives Streamlit reruns:
+    an in-memory LRU, backed by `diskcache` on disk when it is installed.
+    """
+    try:
+        import diskcache
+        disk = diskcache.Cache(RESPONSE_CACHE_DIR)
+    except ImportError:
+        disk = None
+    return {"memory": OrderedDict(), "disk": disk, "lock": threading.Lock()}
+
+def response_cache_key(model, prompt: str) -> str:
+    # The prompt already embeds role/language, so (model, prompt) is the full key.
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(model.model_name.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(prompt.encode("utf-8"))
+    return digest.hexdigest()
+
+def response_cache_get(key: str) -> Optional[str]:
+    cache = get_response_cache()
+    with cache["lock"]:
+        memory = cache["memory"]
+        if key in memory:
+            memory.move_to_end(key)
+            return memory[key]
+    if cache["disk"] is not None:
+        text = cache["disk"].get(key)
+        if text is not None:
+            response_cache_put(key, text, persist=False)
+        return text
+    return None
+
+def response_cache_put(key: str, text: str, persist: bool = True) -> None:
+    cache = get_response_cache()
+    with cache["lock"]:
+        memory = cache["memory"]
+        memory[key] = text
+        memory.move_to_end(key)
+        while len(memory) > RESPONSE_CACHE_SIZE:
+            memory.popitem(last=False)
+    if persist and cache["disk"] is not None:
+        cache["disk"].set(key, text)
+
+# =========================
+# HELPER: SEMANTIC CACHE
+# =========================
+EMBED_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+SEMANTIC_CACHE_THRESHOLD = 0.93
+SEMANTIC_CACHE_DIR = os.path.join(RESPONSE_CACHE_DIR, "semantic")
+SEMANTIC_CACHE_MAX_ENTRIES = 256  # per namespace; the oldest are evicted first
+SEMANTIC_CACHE_PERSIST_EVERY = 16  # inserts between writes of a namespace to disk
+
+@st.cache_resource(show_spinner=False)
+def load_embedder():
+    sentence_transformers = _get_sentence_transformers()
+    if sentence_transformers is None:
+        return None
+    return sentence_transformers.SentenceTransformer(EMBED_MODEL_NAME)
+
+def embed_texts(texts: List[str]):
+    """
+    Unit-normalised float32 embeddings (so inner product == cosine),
+    or None if sentence-transformers is not installed.
+    """
+    embedder = load_embedder()
+    if embedder is None:
+        return None
+    vectors = embedder.encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+    return vectors.astype("float32")
+
+@st.cache_resource(show_spinner=False)
+def get_semantic_cache() -> Dict[str, Any]:
+    """
+    Near-duplicate prompt cache: one FAISS inner-product index per namespace
+    (tool + language + context), with a parallel list of
+    {"reply", "tokens"} entries.
+    """
+    return {"faiss": _get_faiss(), "stores": {}, "lock": threading.Lock()}
+
+def semantic_namespace(model, *parts: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (model.model_name,) + parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def semantic_key_tokens(query: str) -> List[str]:
+    # MiniLM barely separates "phase 1" from "phase 2", so numbers and quoted
+    # strings must match exactly for a semantic hit to count.
+    return sorted(re.findall(r"\d+(?:[.,:]\d+)*|\"[^\"]+\"|'[^']+'", query.lower()))
+
+def _semantic_store(cache: Dict[str, Any], namespace: str, dim: int) -> Dict[str, Any]:
+    # Caller holds cache["lock"].
+    store = cache["stores"].get(namespace)
+    if store is not None:
+        return store
+
+    faiss = cache["faiss"]
+    index_path = os.path.join(SEMANTIC_CACHE_DIR, f"{namespace}.index")
+    replies_path = os.path.join(SEMANTIC_CACHE_DIR, f"{namespace}.json")
+    if os.path.exists(index_path) and os.path.exists(replies_path):
+        index = faiss.read_index(index_path)
+        with open(replies_path, "r", encoding="utf-8") as fh:
+            replies = json.load(fh)
+    else:
+        index = faiss.IndexFlatIP(dim)
+        replies = []
+
+    store = {
+        "index": index, "replies": replies, "unsaved": 0,
+        "index_path": index_path, "replies_path": replies_path,
+    }
+    cache["stores"][namespace] = store
+    return store
+
+def _persist_semantic_store(cache: Dict[str, Any], store: Dict[str, Any]) -> None:
+    # Caller holds cache["lock"]; stores are capped, so this stays small.
+    os.makedirs(SEMANTIC_CACHE_DIR, exist_ok=True)
+    cache["faiss"].write_index(store["index"], store["index_path"])
+    with open(store["replies_path"], "w", encoding="utf-8") as fh:
+        json.dump(store["replies"], fh)
+    store["unsaved"] = 0
+
+def semantic_cache_lookup(namespace: str, query: str) -> Tuple[Optional[str], Any]:
+    """
+    Return (cached reply or None, (query embedding, key tokens)). The second
+    item is passed back to semantic_cache_put so the query is only embedded once.
+    """
+    cache = get_semantic_cache()
+    if cache["faiss"] is None:
+        return None, None
+    vectors = embed_texts([query])
+    if vectors is None:
+        return None, None
+
+    tokens = semantic_key_tokens(query)
+    with cache["lock"]:
+        store = _semantic_store(cache, namespace, vectors.shape[1])
+        if store["index"].ntotal == 0:
+            return None, (vectors, tokens)
+        scores, ids = store["index"].search(vectors, min(4, store["index"].ntotal))
+        for score, i in zip(scores[0], ids[0]):
+            if score < SEMANTIC_CACHE_THRESHOLD:
+                break
+            entry = store["replies"][i]
+            if isinstance(entry, dict) and entry["tokens"] == tokens:
+                return entry["reply"], (vectors, tokens)
+    return None, (vectors, tokens)
+
+def semantic_cache_put(namespace: str, entry, reply: str) -> None:
+    """
+    Add a reply under the (embedding, key tokens) pair returned by
+    semantic_cache_lookup, evicting the oldest entries past the cap.
+    """
+    if entry is None or not reply:
+        return
+    vectors, tokens = entry
+    cache = get_semantic_cache()
+    faiss = cache["faiss"]
+    with cache["lock"]:
+        store = _semantic_store(cache, namespace, vectors.shape[1])
+        overflow = store["index"].ntotal + 1 - SEMANTIC_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            store["index"].remove_ids(faiss.IDSelectorRange(0, overflow))
+            del store["replies"][:overflow]
+        store["index"].add(vectors)
+        store["replies"].append({"reply": reply, "tokens": tokens})
+        store["unsaved"] += 1
+        if store["unsaved"] >= SEMANTIC_CACHE_PERSIST_EVERY:
+            _persist_semantic_store(cache, store)
+
+# =========================
+# HELPER: CALL GEMINI
+# =========================
+def finished_normally(response) -> bool:
+    # Only cache complete replies: a safety block or a MAX_TOKENS cut-off
+    # would otherwise be served for that prompt forever.
+    candidates = response.candidates
+    return bool(candidates) and candidates[0].finish_reason == glm.Candidate.FinishReason.STOP
+
+async def _stream_and_cache(response, key: Optional[str], semantic: Optional[Tuple[str, Any]]) -> AsyncIterator[str]:
+    buf = io.StringIO()
+    last_chunk = None
+    async for chunk in response:
+        last_chunk = chunk
+        if chunk.parts:
+            text = chunk.text
+            buf.write(text)
+            yield text
+    text = buf.getvalue().strip()
+    if not text or last_chunk is None or not finished_normally(last_chunk):
+        return
+    if key is not None:
+        response_cache_put(key, text)
+    if semantic is not None:
+        await asyncio.to_thread(semantic_cache_put, semantic[0], semantic[1], text)
+
+async def generate_reply(
+    model,
+    contents,
+    stream: bool = False,
+    cache: bool = False,
+    semantic: Optional[Tuple[str, str]] = None
+) -> Union[str, AsyncIterator[str]]:
+    """
+    Call Gemini through its async client. With stream=True, return an async
+    iterator of text chunks so the UI can render tokens as they arrive
+    instead of waiting for the full reply.
+
+    With cache=True (only for self-contained string prompts), identical prompts
+    are answered from the response cache without calling the model.
+    semantic=(namespace, query) additionally answers near-duplicate queries
+    from the semantic cache.
+    """
+    key = None
+    if cache:
+        key = response_cache_key(model, contents)
+        cached = response_cache_get(key)
+        if cached is not None:
+            return cached
+
+    semantic_entry = None
+    if semantic is not None:
+        namespace, query = semantic
+        # Embedding is CPU-bound; keep it off the shared event loop.
+        cached, entry = await asyncio.to_thread(semantic_cache_lookup, namespace, query)
+        if cached is not None:
+            return cached
+        if entry is not None:
+            semantic_entry = (namespace, entry)
+
+    if stream:
+        response = await model.generate_content_async(contents, stream=True)
+        return _stream_and_cache(response, key, semantic_entry)
+
+    response = await model.generate_content_async(contents)
+    text = response.text.strip()
+    if not text or not finished_normally(response):
+        return text
+    if key is not None:
+        response_cache_put(key, text)
+    if semantic_entry is not None:
+        await asyncio.to_thread(semantic_cache_put, semantic_entry[0], semantic_entry[1], text)
+    return text
+
+def parse_json_reply(text: str) -> Any:
+    """
+    Parse a JSON model reply, tolerating a ```json fence. Returns None if
+    the reply is not valid JSON.
+    """
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`")
+        if text.startswith("json"):
+            text = text[len("json"):]
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+def iterate_async(chunks: AsyncIterator[str]) -> Iterator[str]:
+    """
+    Drive an async iterator on the shared event loop from the script thread.
+    """
+    loop = get_event_loop()
+    while True:
+        try:
+            yield asyncio.run_coroutine_threadsafe(chunks.__anext__(), loop).result()
+        except StopAsyncIteration:
+            return
+
+RENDER_INTERVAL = 0.05  # seconds between placeholder refreshes while streaming
+
+def render_reply(reply: Union[str, Iterator[str], AsyncIterator[str]]) -> str:
+    """
+    Render a tool reply (plain text or streamed chunks) into a placeholder
+    and return the full text.
+    """
+    placeholder = st.empty()
+    if isinstance(reply, str):
+        placeholder.markdown(reply)
+        return reply
+    if hasattr(reply, "__anext__"):
+        reply = iterate_async(reply)
+
+    # Accumulate in one buffer and re-render at most every RENDER_INTERVAL
+    # seconds, instead of rebuilding the string and the markdown per chunk.
+    buf = io.StringIO()
+    last_render = 0.0
+    for text in reply:
+        buf.write(text)
+        now = time.monotonic()
+        if now - last_render >= RENDER_INTERVAL:
+            placeholder.markdown(buf.getvalue())
+            last_render = now
+    full = buf.getvalue().strip()
+    placeholder.markdown(full)
+    return full
+
 # =========================
 # FILE / DOC HANDLING
 # =========================
+MAX_EXTRACT_WORKERS = 8
+# Below this much text, a PDF with text-less pages is treated as a scan.
+SCANNED_PDF_MIN_CHARS = 200
+
 def read_txt_file(file) -> str:
     return file.read().decode("utf-8", errors="ignore")
 
-def read_pdf_file(file) -> str:
-    try:
-        from PyPDF2 import PdfReader
-    except ImportError:
-        return "PyPDF2 is not installed. Please install it with `pip install PyPDF2`."
+@st.cache_resource(show_spinner=False)
+def get_pdfium_lock() -> threading.Lock:
+    # PDFium is not thread-safe, even across different documents.
+    return threading.Lock()
 
-    reader = PdfReader(file)
-    text = []
+def read_pdf_file(file) -> Tuple[str, bool]:
+    """
+    Extract PDF text with pypdfium2 (C++ PDFium), falling back to PyPDF2.
+    Pages without any text are skipped. Returns (text, looks_scanned).
+    """
+    pdfium = _get_pdfium()
+    if pdfium is None:
+        return read_pdf_file_pypdf2(file)
+
+    # Write pages straight into one buffer instead of a list + join,
+    # which would hold every page twice at peak for large PDFs.
+    buf = io.StringIO()
+    has_textless_pages = False
+    with get_pdfium_lock():
+        pdf = pdfium.PdfDocument(file)
+        try:
+            for i in range(len(pdf)):
+                page = pdf[i]
+                textpage = page.get_textpage()
+                if textpage.count_chars() == 0:
+                    has_textless_pages = True
+                else:
+                    if buf.tell():
+                        buf.write("\n")
+                    buf.write(textpage.get_text_range())
+                textpage.close()
+                page.close()
+        finally:
+            pdf.close()
+    text = buf.getvalue()
+    return text, has_textless_pages and len(text.strip()) < SCANNED_PDF_MIN_CHARS
+
+def read_pdf_file_pypdf2(file) -> Tuple[str, bool]:
+    pypdf2 = _get_pypdf2()
+    if pypdf2 is None:
+        return "No PDF library is installed. Please install it with `pip install pypdfium2` or `pip install PyPDF2`.", False
+
+    reader = pypdf2.PdfReader(file)
+    buf = io.StringIO()
+    has_textless_pages = False
     for page in reader.pages:
-        text.append(page.extract_text() or "")
-    return "\n".join(text)
+        # Pages without a content stream have nothing to extract.
+        page_text = page.extract_text() if page.get_contents() is not None else ""
+        if page_text:
+            if buf.tell():
+                buf.write("\n")
+            buf.write(page_text)
+        else:
+            has_textless_pages = True
+    text = buf.getvalue()
+    return text, has_textless_pages and len(text.strip()) < SCANNED_PDF_MIN_CHARS
+
+def extract_file_text(f) -> Tuple[str, bool]:
+    if f.name.lower().endswith(".txt"):
+        return read_txt_file(f), False
+    elif f.name.lower().endswith(".pdf"):
+        return read_pdf_file(f)
+    return f"Unsupported file type: {f.name}", False
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _extract_cached(file_bytes: bytes, name: str) -> Tuple[str, bool]:
+    """
+    Extract text keyed on file content + name, so Streamlit reruns with the
+    same uploads skip re-parsing.
+    """
+    buffer = io.BytesIO(file_bytes)
+    buffer.name = name
+    return extract_file_text(buffer)
 
-def get_uploaded_text(files: List[Any]) -> str:
+def get_uploaded_text(files: List[Any]) -> Tuple[str, List[str]]:
     """
     Merge all uploaded files (PDF + TXT) into single text context.
+    Also returns the names of PDFs that look scanned (image-only, little or
+    no extractable text), so the UI can suggest OCR.
     """
     if not files:
-        return ""
-
-    full_text = []
-    for f in files:
-        if f.name.lower().endswith(".txt"):
-            full_text.append(read_txt_file(f))
-        elif f.name.lower().endswith(".pdf"):
-            full_text.append(read_pdf_file(f))
-        else:
-            full_text.append(f"Unsupported file type: {f.name}")
-    return "\n\n".join(full_text)
+        return "", []
+
+    # Files are independent, so extract them concurrently; map() keeps upload order.
+    with ThreadPoolExecutor(max_workers=min(MAX_EXTRACT_WORKERS, len(files))) as executor:
+        results = list(executor.map(lambda f: _extract_cached(f.getvalue(), f.name), files))
+    full_text = io.StringIO()
+    for text, _ in results:
+        if text:
+            if full_text.tell():
+                full_text.write("\n\n")
+            full_text.write(text)
+    scanned = [f.name for f, (_, looks_scanned) in zip(files, results) if looks_scanned]
+    return full_text.getvalue(), scanned
 
 # =========================
-# AGENT "TOOLS" (SKILLS)
+# TOKEN BUDGETS
 # =========================
-def tool_general_chat(model, user_input: str, language: str, role: str, history: List[Dict]) -> str:
-    # ✅ Convert system prompt into a USER message (Gemini-compatible)
-    system_prompt = f"""
-You are GenieTalk, an AI agentic assistant.
+# Budgets are in tokens, not characters: non-Latin scripts (Hindi, Tamil...)
+# take several UTF-8 bytes per character and tokenise very differently.
+DOC_QA_TOKEN_BUDGET = 6000
+RESUME_TOKEN_BUDGET = 5000
+AGENT_DOC_TOKEN_BUDGET = 2000
+
+@st.cache_resource(show_spinner=False)
+def get_token_encoder():
+    # cl100k_base is not Gemini's tokenizer, but it is a close, local estimate.
+    tiktoken = _get_tiktoken()
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        # The encoding file could not be downloaded (offline).
+        return None
 
-Role: {role}
+@st.cache_data(show_spinner=False, max_entries=32)
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut text to at most ~max_tokens tokens. Without tiktoken, assume
+    ~4 UTF-8 bytes per token. Cached, so the same document is only
+    tokenised once per budget.
+    """
+    if len(text) * 4 <= max_tokens:
+        return text  # a token is at least one UTF-8 byte, a character at most four
 
-You must:
-- Be helpful and concise.
-- Adapt your tone to the role (e.g., more emotional for Emotional Support, technical for Coding Help).
-- Always respond in this language: {language}.
-"""
+    encoder = get_token_encoder()
+    if encoder is None:
+        data = text.encode("utf-8")
+        if len(data) <= max_tokens * 4:
+            return text
+        return data[:max_tokens * 4].decode("utf-8", errors="ignore")
 
-    contents = []
+    tokens = encoder.encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoder.decode(tokens[:max_tokens])
 
-    # ✅ System prompt goes as USER
-    contents.append({
-        "role": "user",
-        "parts": [system_prompt]
-    })
+# =========================
+# DOCUMENT RETRIEVAL (RAG)
+# =========================
+DOC_CHUNK_CHARS = 2000  # ~500 tokens of English text
+DOC_CHUNK_OVERLAP = 200
+DOC_TOP_K = 5
 
-    # ✅ Previous chat history
-    for msg in history:
-        contents.append({
-            "role": "user",
-            "parts": [msg["user"]]
-        })
-        contents.append({
-            "role": "model",
-            "parts": [msg["assistant"]]
-        })
+def split_text(text: str, chunk_chars: int = DOC_CHUNK_CHARS, overlap: int = DOC_CHUNK_OVERLAP) -> List[str]:
+    """
+    Split text into ~chunk_chars pieces, preferring paragraph, line, sentence
+    and word boundaries, with a small overlap between neighbouring chunks.
+    """
+    chunks = []
+    start = 0
+    n = len(text)
+    while start < n:
+        end = min(start + chunk_chars, n)
+        if end < n:
+            for sep in ("\n\n", "\n", ". ", " "):
+                cut = text.rfind(sep, start + chunk_chars // 2, end)
+                if cut != -1:
+                    end = cut + len(sep)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= n:
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def build_doc_index(doc_text: str) -> Optional[Dict[str, Any]]:
+    """
+    Chunk and embed a document once into a FAISS inner-product index.
+    Returns None if sentence-transformers or faiss is not installed.
+    """
+    faiss = _get_faiss()
+    if faiss is None:
+        return None
+
+    chunks = split_text(doc_text)
+    if not chunks:
+        return None
+    vectors = embed_texts(chunks)
+    if vectors is None:
+        return None
+
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    return {"chunks": chunks, "index": index}
+
+def retrieve_doc_context(doc_text: str, question: str, k: int = DOC_TOP_K) -> Optional[str]:
+    """
+    Return the top-k chunks most relevant to the question (in document order),
+    or None if retrieval is unavailable.
+    """
+    doc_index = build_doc_index(doc_text)
+    if doc_index is None:
+        return None
 
-    # ✅ Current user input
-    contents.append({
-        "role": "user",
-        "parts": [user_input]
-    })
+    chunks = doc_index["chunks"]
+    if len(chunks) <= k:
+        return "\n\n".join(chunks)
 
-    # ✅ Generate response
-    response = model.generate_content(contents)
-    return response.text.strip()
+    vectors = embed_texts([question])
+    _, ids = doc_index["index"].search(vectors, k)
+    return "\n...\n".join(chunks[i] for i in sorted(ids[0]) if i >= 0)
+
+# =========================
+# BACKGROUND DOCUMENT LOADING
+# =========================
+DOC_ROLES = ("Document QA", "Resume Review")
 
+@st.cache_resource(show_spinner=False)
+def get_background_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="genietalk-docs")
 
-def tool_document_qa(model, question: str, doc_text: str, language: str) -> str:
-    if not doc_text.strip():
-        return f"(I could not find any document text. Please upload a PDF or TXT first.)"
+def load_documents(files: List[Any], build_index: bool) -> Tuple[str, List[str]]:
+    """
+    Background job: extract uploaded files and, if requested, warm the
+    retrieval index, so the chat stays responsive while this runs.
+    """
+    doc_text, scanned = get_uploaded_text(files)
+    if doc_text and build_index:
+        build_doc_index(doc_text)
+    return doc_text, scanned
+
+def warn_scanned(placeholder, scanned_files: List[str]) -> None:
+    if scanned_files:
+        placeholder.warning(
+            "These PDFs look scanned (little or no extractable text): "
+            + ", ".join(scanned_files)
+            + ". Run them through OCR first for document QA or resume review."
+        )
+
+# =========================
+# PROMPT TEMPLATES
+# =========================
+GENERAL_CHAT_SYSTEM_PROMPT = """
+You are GenieTalk, an AI agentic assistant.
+
+Role: {role}
+
+You must:
+- Be helpful and concise.
+- Adapt your tone to the role (e.g., more emotional for Emotional Support, technical for Coding Help).
+- Always respond in this language: {language}.
+"""
 
-    prompt = f"""
+DOCUMENT_QA_PROMPT = """
 You are a document QA assistant.
 
 You receive:
 - A question from the user
-- Full extracted text from one or more documents
+- The most relevant extracted text from one or more documents
 
 1. First, briefly state what you understood about the question.
 2. Then answer using ONLY the document text when possible.
@@ -124,13 +722,10 @@ User question:
 {question}
 
 Document text:
-\"\"\"{doc_text[:25000]}\"\"\"  # (truncated if very long)
+\"\"\"{context}\"\"\"
 """
-    response = model.generate_content(prompt)
-    return response.text.strip()
 
-def tool_translate(model, text: str, target_language: str) -> str:
-    prompt = f"""
+TRANSLATE_PROMPT = """
 You are a professional translator.
 
 Translate the following text into: {target_language}.
@@ -140,14 +735,20 @@ Keep the original meaning, tone, and style.
 Text:
 \"\"\"{text}\"\"\"
 """
-    response = model.generate_content(prompt)
-    return response.text.strip()
 
-def tool_resume_review(model, resume_text: str, language: str) -> str:
-    if not resume_text.strip():
-        return "Please upload your resume as PDF/TXT or paste it so I can review it."
+TRANSLATE_BATCH_PROMPT = """
+You are a professional translator.
+
+Translate EACH message in the JSON array below into: {target_language}.
+
+Keep the original meaning, tone, and style of every message.
+Return ONLY a JSON array of strings: one translation per message, same order, same length.
 
-    prompt = f"""
+Messages:
+{messages}
+"""
+
+RESUME_REVIEW_PROMPT = """
 You are a resume and career advisor.
 
 You receive a resume text and must:
@@ -159,13 +760,10 @@ You receive a resume text and must:
 Answer in this language: {language}.
 
 Resume text:
-\"\"\"{resume_text[:20000]}\"\"\"
+\"\"\"{resume_text}\"\"\"
 """
-    response = model.generate_content(prompt)
-    return response.text.strip()
 
-def tool_coding_help(model, question: str, language: str) -> str:
-    prompt = f"""
+CODING_HELP_PROMPT = """
 You are a senior software engineer and coding mentor.
 
 User question:
@@ -177,11 +775,8 @@ You must:
 - Add short comments.
 - Answer in language: {language}.
 """
-    response = model.generate_content(prompt)
-    return response.text.strip()
 
-def tool_emotional_support(model, message: str, language: str) -> str:
-    prompt = f"""
+EMOTIONAL_SUPPORT_PROMPT = """
 You are a supportive, empathetic friend.
 
 User message:
@@ -194,52 +789,55 @@ You must:
 - Encourage them to reach out to trusted people or professionals if needed.
 - Answer in language: {language}.
 """
-    response = model.generate_content(prompt)
-    return response.text.strip()
 
-# =========================
-# AGENTIC MODE: PLAN + ACT
-# =========================
-def agentic_plan_and_execute(
-    model,
-    goal: str,
-    role: str,
-    language: str,
-    doc_text: str,
-    chat_history: List[Dict]
-) -> Dict[str, Any]:
-    """
-    Agentic behavior:
-    1. Understand user's high-level goal.
-    2. Create a mini-plan (3–6 steps).
-    3. Decide which "skills/tools" to use per step.
-    4. Execute (within a single model call, but logically multi-step).
-    """
+SUMMARIZE_HISTORY_PROMPT = """
+You keep a running summary of a conversation between a user and GenieTalk.
 
-    available_tools_description = """
-You have these internal skills/tools:
+Current summary (may be empty):
+\"\"\"{summary}\"\"\"
 
-1. general_chat: For broad reasoning, explanation, brainstorming.
-2. coding_help: For code, debugging, writing functions, etc.
-3. resume_review: For CV/resume critique and job guidance.
-4. emotional_support: For empathy and motivation (not medical).
-5. document_qa: For answering questions about uploaded PDFs/TXTs.
-6. translate: For translating text into user's target language.
+Older turns to fold into the summary:
+{turns}
 
-You cannot actually call external APIs here; you must "simulate" tool use by clearly reasoning.
+Return an updated summary in at most 150 words. Keep names, facts, decisions,
+open questions and user preferences; drop small talk.
 """
 
-    history_text = ""
-    if chat_history:
-        history_text = "\nPrevious conversation:\n"
-        for turn in chat_history[-6:]:  # last few turns
-            history_text += f"User: {turn['user']}\nAssistant: {turn['assistant']}\n"
+AGENT_STEP_PROMPT = """
+You are GenieTalk, executing one step of a larger plan.
 
-    doc_hint = ""
-    if doc_text.strip():
-        doc_hint = f"\n\nThe user also provided document text. You can treat it as context when needed:\n\"\"\"{doc_text[:8000]}\"\"\""
+Overall user goal:
+\"\"\"{goal}\"\"\"
+
+Skill for this step: {tool}
+{tool_instructions}
+
+Sub-task:
+{subquery}
+{context}
+Do only this sub-task, concisely. Answer in this language: {language}.
+"""
+
+AGENT_PLAN_PROMPT = """
+You are GenieTalk, an AGENTIC AI assistant. Plan how to reach the user's goal.
+
+User goal:
+\"\"\"{goal}\"\"\"
 
-    prompt = f"""
+Role: {role}
+
+{available_tools_description}
+
+Break the goal into 3–6 steps that can be worked on INDEPENDENTLY and in parallel.
+Each subquery must be self-contained (repeat any needed details from the goal).
+
+Return ONLY a JSON array, no prose, in this form:
+[{{"step": 1, "tool": "<one of the tool names above>", "subquery": "<what to do>"}}]
+
+{history_text}
+"""
+
+AGENT_SINGLE_CALL_PROMPT = """
 You are GenieTalk, an AGENTIC AI assistant.
 
 User goal:
@@ -249,6 +847,7 @@ Role: {role}
 Target answer language: {language}
 
 {available_tools_description}
+You cannot actually call external APIs here; you must "simulate" tool use by clearly reasoning.
 
 Your job:
 1. Briefly restate the goal.
@@ -268,13 +867,414 @@ Be practical and focused. If documents are relevant, you may use them conceptual
 {history_text}
 {doc_hint}
 """
-    response = model.generate_content(prompt)
-    text = response.text.strip()
+
+AGENT_FINAL_PROMPT = """
+You are GenieTalk, an AGENTIC AI assistant.
+
+User goal:
+\"\"\"{goal}\"\"\"
+
+Your plan was executed step by step. Step results:
+{steps_text}
+
+Combine these results into one clean, practical FINAL ANSWER the user can read directly.
+Do not repeat the step headings. Answer in this language: {language}.
+"""
+
+AGENT_TOOLS_DESCRIPTION = """
+You have these internal skills/tools:
+
+1. general_chat: For broad reasoning, explanation, brainstorming.
+2. coding_help: For code, debugging, writing functions, etc.
+3. resume_review: For CV/resume critique and job guidance.
+4. emotional_support: For empathy and motivation (not medical).
+5. document_qa: For answering questions about uploaded PDFs/TXTs.
+6. translate: For translating text into user's target language.
+"""
+
+# =========================
+# AGENT "TOOLS" (SKILLS)
+# =========================
+async def tool_general_chat(
+    model,
+    user_input: str,
+    language: str,
+    role: str,
+    history: List[Dict],
+    stream: bool = False,
+    summary: str = ""
+) -> Union[str, AsyncIterator[str]]:
+    # ✅ System prompt (plus the rolling summary of older turns) goes as a USER
+    # message (Gemini-compatible), then recent chat history, then the current input
+    system_parts = [GENERAL_CHAT_SYSTEM_PROMPT.format(role=role, language=language)]
+    if summary:
+        system_parts.append(f"Summary of the earlier conversation:\n{summary}")
+    contents = (
+        [{"role": "user", "parts": system_parts}]
+        + [
+            turn
+            for msg in history
+            for turn in (
+                {"role": "user", "parts": [msg["user"]]},
+                {"role": "model", "parts": [msg["assistant"]]},
+            )
+        ]
+        + [{"role": "user", "parts": [user_input]}]
+    )
+
+    # ✅ Generate response
+    return await generate_reply(model, contents, stream=stream)
+
+async def tool_summarize(model, summary: str, turns: List[Dict]) -> str:
+    turns_text = "".join(f"User: {t['user']}\nAssistant: {t['assistant']}\n" for t in turns)
+    prompt = SUMMARIZE_HISTORY_PROMPT.format(summary=summary, turns=turns_text)
+    return await generate_reply(model, prompt)
+
+async def tool_document_qa(model, question: str, doc_text: str, language: str, stream: bool = False) -> Union[str, AsyncIterator[str]]:
+    if not doc_text.strip():
+        return f"(I could not find any document text. Please upload a PDF or TXT first.)"
+
+    # Send only the retrieved chunks; fall back to a plain prefix without retrieval.
+    context = await asyncio.to_thread(retrieve_doc_context, doc_text, question)
+    if context is None:
+        context = await asyncio.to_thread(truncate_to_tokens, doc_text, DOC_QA_TOKEN_BUDGET)
+
+    prompt = DOCUMENT_QA_PROMPT.format(language=language, question=question, context=context)
+    doc_digest = hashlib.blake2b(doc_text.encode("utf-8"), digest_size=16).hexdigest()
+    semantic = (semantic_namespace(model, "document_qa", language, doc_digest), question)
+    return await generate_reply(model, prompt, stream=stream, cache=True, semantic=semantic)
+
+async def tool_translate(model, text: str, target_language: str, stream: bool = False) -> Union[str, AsyncIterator[str]]:
+    prompt = TRANSLATE_PROMPT.format(target_language=target_language, text=text)
+    # Exact-match cache only: near-duplicate texts ("Meet at 5 pm" / "6 pm")
+    # embed almost identically but must not share a translation.
+    return await generate_reply(model, prompt, stream=stream, cache=True)
+
+async def tool_translate_batch(model, texts: List[str], target_language: str) -> List[str]:
+    """
+    Translate several messages with one model call instead of one call each.
+    Messages already in the response cache are not sent again; if the batched
+    reply cannot be mapped back, the rest are translated one by one (concurrently).
+    """
+    if len(texts) == 1:
+        return [await tool_translate(model, texts[0], target_language)]
+
+    # Share cache entries with single-message tool_translate calls.
+    keys = [
+        response_cache_key(model, TRANSLATE_PROMPT.format(target_language=target_language, text=text))
+        for text in texts
+    ]
+    results = [response_cache_get(key) for key in keys]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if not pending:
+        return results
+
+    prompt = TRANSLATE_BATCH_PROMPT.format(
+        target_language=target_language,
+        messages=json.dumps([texts[i] for i in pending], ensure_ascii=False, indent=1),
+    )
+    translations = parse_json_reply(await generate_reply(model, prompt))
+    if isinstance(translations, list) and len(translations) == len(pending):
+        for i, translation in zip(pending, translations):
+            # Only cache real translations; anything else is retried below.
+            if isinstance(translation, str) and translation.strip():
+                results[i] = translation.strip()
+                response_cache_put(keys[i], results[i])
+
+    # Messages the batch did not answer are translated one by one;
+    # generate_reply caches each of those only if it finished normally.
+    retry = [i for i in pending if results[i] is None]
+    translations = await asyncio.gather(
+        *[tool_translate(model, texts[i], target_language) for i in retry],
+        return_exceptions=True,
+    )
+    for i, translation in zip(retry, translations):
+        results[i] = f"(This translation failed: {translation})" if isinstance(translation, Exception) else translation
+    return results
+
+async def tool_resume_review(model, resume_text: str, language: str, stream: bool = False) -> Union[str, AsyncIterator[str]]:
+    if not resume_text.strip():
+        return "Please upload your resume as PDF/TXT or paste it so I can review it."
+
+    # Tokenising a long resume is CPU-bound; keep it off the shared event loop.
+    resume_text = await asyncio.to_thread(truncate_to_tokens, resume_text, RESUME_TOKEN_BUDGET)
+    prompt = RESUME_REVIEW_PROMPT.format(language=language, resume_text=resume_text)
+    return await generate_reply(model, prompt, stream=stream, cache=True)
+
+RESUME_REVIEW_CONCURRENCY = 4  # in-flight Gemini calls per bulk review
+
+async def review_resumes_as_completed(
+    model,
+    resumes: List[Tuple[str, str]],
+    language: str
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Review (name, text) resumes concurrently, at most RESUME_REVIEW_CONCURRENCY
+    at a time, and yield (name, review) as each finishes. Shortest resumes
+    (length is a proxy for token count) are started first, so short CVs are
+    not held up behind long ones.
+    """
+    semaphore = asyncio.Semaphore(RESUME_REVIEW_CONCURRENCY)
+
+    async def review(name: str, text: str) -> Tuple[str, str]:
+        async with semaphore:
+            try:
+                return name, await tool_resume_review(model, text, language)
+            except Exception as e:
+                return name, f"(This review failed: {e})"
+
+    ordered = sorted(resumes, key=lambda item: len(item[1]))
+    for next_done in asyncio.as_completed([review(name, text) for name, text in ordered]):
+        yield await next_done
+
+async def tool_coding_help(model, question: str, language: str, stream: bool = False) -> Union[str, AsyncIterator[str]]:
+    prompt = CODING_HELP_PROMPT.format(question=question, language=language)
+    semantic = (semantic_namespace(model, "coding_help", language), question)
+    return await generate_reply(model, prompt, stream=stream, cache=True, semantic=semantic)
+
+async def tool_emotional_support(model, message: str, language: str, stream: bool = False) -> Union[str, AsyncIterator[str]]:
+    prompt = EMOTIONAL_SUPPORT_PROMPT.format(message=message, language=language)
+    return await generate_reply(model, prompt, stream=stream, cache=True)
+
+# =========================
+# AGENTIC MODE: PLAN + ACT
+# =========================
+AGENT_TOOLS = {
+    "general_chat": "Reason clearly: explain, analyse or brainstorm as needed.",
+    "coding_help": "Act as a senior software engineer: explain briefly and give minimal, correct, commented code.",
+    "resume_review": "Act as a resume and career advisor. Use the document text as the resume if provided.",
+    "emotional_support": "Be an empathetic, supportive friend. Do not give medical or clinical diagnosis.",
+    "document_qa": "Answer using ONLY the document text when possible, and say clearly if something is not in it.",
+    "translate": "Translate faithfully, keeping the original meaning, tone and style.",
+}
+
+def parse_plan(text: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Parse the planner's JSON reply into a list of {step, tool, subquery}.
+    Returns None if the reply is not a usable plan.
+    """
+    plan = parse_json_reply(text)
+    if not isinstance(plan, list) or not plan:
+        return None
+
+    steps = []
+    for i, item in enumerate(plan, start=1):
+        if not isinstance(item, dict) or not str(item.get("subquery", "")).strip():
+            return None
+        tool = item.get("tool")
+        steps.append({
+            "step": i,
+            "tool": tool if tool in AGENT_TOOLS else "general_chat",
+            "subquery": str(item["subquery"]).strip(),
+        })
+    return steps
+
+async def build_step_prompt(
+    step: Dict[str, Any],
+    goal: str,
+    language: str,
+    doc_text: str,
+    extra_context: str = ""
+) -> str:
+    """
+    Prompt for one plan step; document tools get the most relevant excerpt.
+    extra_context is added before it.
+    """
+    context = extra_context
+    if doc_text.strip() and step["tool"] in ("document_qa", "resume_review"):
+        excerpt = await asyncio.to_thread(retrieve_doc_context, doc_text, step["subquery"])
+        excerpt = excerpt or await asyncio.to_thread(truncate_to_tokens, doc_text, AGENT_DOC_TOKEN_BUDGET)
+        context += f"\nDocument text:\n\"\"\"{excerpt}\"\"\"\n"
+    return AGENT_STEP_PROMPT.format(
+        goal=goal,
+        tool=step["tool"],
+        tool_instructions=AGENT_TOOLS[step["tool"]],
+        subquery=step["subquery"],
+        context=context,
+        language=language,
+    )
+
+async def run_plan_steps(model, plan: List[Dict[str, Any]], goal: str, language: str, doc_text: str) -> List[str]:
+    """
+    Execute all plan steps concurrently, so latency is roughly the slowest
+    step rather than the sum of all steps.
+    """
+    async def run_step(step: Dict[str, Any]) -> str:
+        return await generate_reply(model, await build_step_prompt(step, goal, language, doc_text))
+
+    results = await asyncio.gather(*[run_step(step) for step in plan], return_exceptions=True)
+    return [
+        f"(This step failed: {result})" if isinstance(result, Exception) else result
+        for result in results
+    ]
+
+async def _prepend(header: str, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    yield header
+    async for chunk in chunks:
+        yield chunk
+
+async def agentic_plan_and_execute(
+    model,
+    goal: str,
+    role: str,
+    language: str,
+    doc_text: str,
+    chat_history: List[Dict],
+    stream: bool = False,
+    route: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Agentic behavior:
+    1. Understand user's high-level goal.
+    2. Create a mini-plan (3–6 steps) as JSON, one "skill/tool" per step.
+    3. Execute the independent steps concurrently (one model call each).
+    4. Combine the step results into a final answer.
+
+    If the local router already picked a single tool (route) and the goal
+    does not ask for planning, skip the planner and the final combine call:
+    the goal is one step for that tool, with the role, recent conversation
+    and document hint passed along.
+    If the planner does not return a usable plan, fall back to a single
+    model call that plans and executes in one go.
+
+    With stream=True, "agentic_explanation" is an async iterator of text chunks.
+    """
+    history_text = ""
+    if chat_history:
+        history_text = "\nPrevious conversation:\n"
+        for turn in chat_history[-6:]:  # last few turns
+            history_text += f"User: {turn['user']}\nAssistant: {turn['assistant']}\n"
+
+    doc_hint = ""
+    if doc_text.strip():
+        doc_excerpt = await asyncio.to_thread(truncate_to_tokens, doc_text, AGENT_DOC_TOKEN_BUDGET)
+        doc_hint = f"\n\nThe user also provided document text. You can treat it as context when needed:\n\"\"\"{doc_excerpt}\"\"\""
+
+    if route is not None and not PLANNING_PATTERN.search(goal.lower()):
+        step = {"step": 1, "tool": route, "subquery": goal}
+        extra_context = f"\nRole: {role}\n{history_text}"
+        if route not in DOC_TOOLS:
+            extra_context += doc_hint  # document tools retrieve their own excerpt
+        prompt = await build_step_prompt(step, goal, language, doc_text, extra_context)
+        header = f"## Goal\n{goal}\n\n## Plan\n1. **{route}** — {goal}\n\n## Final Answer\n"
+        reply = await generate_reply(model, prompt, stream=stream)
+        return {
+            "agentic_explanation": header + reply if isinstance(reply, str) else _prepend(header, reply),
+            "plan": [step],
+        }
+
+    # ===== PHASE 1: PLAN =====
+    plan_prompt = AGENT_PLAN_PROMPT.format(
+        goal=goal,
+        role=role,
+        available_tools_description=AGENT_TOOLS_DESCRIPTION,
+        history_text=history_text,
+    )
+    plan = parse_plan(await generate_reply(model, plan_prompt))
+
+    if plan is None:
+        prompt = AGENT_SINGLE_CALL_PROMPT.format(
+            goal=goal,
+            role=role,
+            language=language,
+            available_tools_description=AGENT_TOOLS_DESCRIPTION,
+            history_text=history_text,
+            doc_hint=doc_hint,
+        )
+        return {
+            "agentic_explanation": await generate_reply(model, prompt, stream=stream),
+            "plan": None,
+        }
+
+    # ===== PHASE 2: ACT (steps in parallel) =====
+    step_results = await run_plan_steps(model, plan, goal, language, doc_text)
+
+    steps_text = ""
+    for step, result in zip(plan, step_results):
+        steps_text += f"\n### Step {step['step']} — {step['tool']}\n_{step['subquery']}_\n\n{result}\n"
+
+    # ===== PHASE 3: FINAL ANSWER =====
+    final_prompt = AGENT_FINAL_PROMPT.format(goal=goal, steps_text=steps_text, language=language)
+    header = f"## Goal\n{goal}\n\n## Plan\n"
+    header += "".join(f"{step['step']}. **{step['tool']}** — {step['subquery']}\n" for step in plan)
+    header += f"\n## Step-by-step Thinking\n{steps_text}\n## Final Answer\n"
+
+    final = await generate_reply(model, final_prompt, stream=stream)
+    if isinstance(final, str):
+        text = header + final
+    else:
+        text = _prepend(header, final)
 
     return {
         "agentic_explanation": text,
+        "plan": plan,
+        "step_results": step_results,
     }
 
+# =========================
+# LOCAL ROUTER
+# =========================
+# Cheap local routing so obvious requests go straight to the right tool.
+# Only strong, unambiguous phrases count: single words like "function",
+# "api" or "feel" are common in everyday questions and would misroute them.
+ROUTE_KEYWORDS = {
+    "coding_help": (
+        "```", "traceback", "stack trace", "syntax error", "syntaxerror", "typeerror",
+        "valueerror", "nullpointerexception", "segmentation fault", "compile error",
+        "compiler error", "regex", "regular expression", "my code", "this code",
+        "python code", "javascript code", "sql query", "write a function", "write a script",
+        "in python", "in javascript", "in typescript", "in rust", "in c++", "in golang",
+    ),
+    "emotional_support": (
+        "i feel sad", "i feel lonely", "i feel anxious", "i feel hopeless", "i feel overwhelmed",
+        "i feel depressed", "i'm depressed", "i am depressed", "i'm so stressed", "i am so stressed",
+        "feeling down", "feeling lonely", "feeling anxious", "heartbroken", "panic attack",
+    ),
+    "resume_review": ("my resume", "this resume", "the resume", "my cv", "this cv", "curriculum vitae"),
+    "document_qa": ("the pdf", "this pdf", "the uploaded", "uploaded file", "uploaded document"),
+}
+DOC_TOOLS = ("document_qa", "resume_review")
+
+def _phrase_pattern(phrase: str) -> str:
+    # Word boundaries only where the phrase starts/ends with a word character,
+    # so "```" still matches "```python".
+    head = r"(?<!\w)" if phrase[0].isalnum() else ""
+    tail = r"(?!\w)" if phrase[-1].isalnum() else ""
+    return head + re.escape(phrase) + tail
+
+ROUTE_PATTERNS = {
+    name: re.compile("|".join(_phrase_pattern(phrase) for phrase in phrases))
+    for name, phrases in ROUTE_KEYWORDS.items()
+}
+
+# Goals with these words need a real plan, even if they mention one tool.
+PLANNING_PATTERN = re.compile(
+    r"(?<!\w)(plan|planning|schedule|roadmap|steps?|strategy|outline|prepare|organi[sz]e"
+    r"|week|month|compare|break down|step by step|and then)(?!\w)"
+)
+
+# General Assistant chat turns that the router sends to a dedicated role.
+ROUTE_ROLES = {
+    "coding_help": "Coding Help",
+    "emotional_support": "Emotional Support",
+    "document_qa": "Document QA",
+    "resume_review": "Resume Review",
+}
+
+def route_request(text: str, has_docs: bool) -> Optional[str]:
+    """
+    Return the single tool that clearly fits the request, or None when it is
+    ambiguous (or a general question) and the full model should decide.
+    """
+    lowered = text.lower()
+    hits = [
+        name for name, pattern in ROUTE_PATTERNS.items()
+        if (has_docs or name not in DOC_TOOLS) and pattern.search(lowered)
+    ]
+    if len(hits) == 1:
+        return hits[0]
+    return None  # no clear signal, or several tools match (a multi-step request)
+
 # =========================
 # SESSION STATE
 # =========================
@@ -282,6 +1282,62 @@ if "messages" not in st.session_state:
     st.session_state.messages = []  # list of {user, assistant}
 if "agent_runs" not in st.session_state:
     st.session_state.agent_runs = []  # store agentic plans/executions
+if "doc_key" not in st.session_state:
+    st.session_state.doc_key = None  # content hash of the uploaded files
+    st.session_state.doc_future = None  # pending background extraction for doc_key
+    st.session_state.doc_text_context = ""  # extracted text for doc_key
+    st.session_state.scanned_files = []  # PDFs in doc_key that look scanned
+if "history_summary" not in st.session_state:
+    st.session_state.history_summary = ""  # rolling summary of turns outside the window
+    st.session_state.summarized_turns = 0  # how many leading messages it covers
+
+def collect_documents() -> None:
+    """
+    Move a finished background extraction into session_state, so later
+    reruns reuse the text instead of touching the future again.
+    """
+    future = st.session_state.doc_future
+    if future is not None and future.done():
+        st.session_state.doc_text_context, st.session_state.scanned_files = future.result()
+        st.session_state.doc_future = None
+
+def wait_for_documents(placeholder) -> None:
+    """
+    Block until the background extraction (if any) is done, so callers read
+    its results instead of parsing the same files again.
+    """
+    if st.session_state.doc_future is not None:
+        with st.spinner("Reading your documents..."):
+            st.session_state.doc_future.result()
+        collect_documents()
+        warn_scanned(placeholder, st.session_state.scanned_files)
+
+# General chat sends only the last MAX_TURNS turns verbatim plus the summary,
+# so prompt size stays roughly constant as the conversation grows. The summary
+# is only rolled right before a general chat call, the one reader of it.
+MAX_TURNS = 8
+
+def recent_history() -> List[Dict]:
+    return st.session_state.messages[st.session_state.summarized_turns:]
+
+def roll_history_summary(model) -> None:
+    """
+    Fold turns that fell out of the MAX_TURNS window into the rolling summary
+    (one summarization call, however many turns overflowed).
+    """
+    overflow = len(recent_history()) - MAX_TURNS
+    if overflow <= 0:
+        return
+    old_turns = recent_history()[:overflow]
+    try:
+        st.session_state.history_summary = run_async(
+            tool_summarize(model, st.session_state.history_summary, old_turns)
+        )
+    except Exception:
+        # Keep the old summary. The turns still move out of the window, so a
+        # reply the summarizer refuses (e.g. a blocked one) is not retried every turn.
+        pass
+    st.session_state.summarized_turns += overflow
 
 # =========================
 # SIDEBAR UI
@@ -325,6 +1381,16 @@ with st.sidebar:
     if reply_language == "Other":
         reply_language = st.text_input("Type target language name", value="English")
 
+    batch_texts = []
+    if role == "Translator":
+        st.markdown("### 📦 Batch Translate")
+        batch_input = st.text_area(
+            "Several messages, one per line",
+            help="All lines are translated together in a single request."
+        )
+        if st.button("Translate all"):
+            batch_texts = [line.strip() for line in batch_input.splitlines() if line.strip()]
+
     st.markdown("### 📂 Upload Documents (optional)")
     uploaded_files = st.file_uploader(
         "Upload PDF/TXT for document QA or resume review",
@@ -332,12 +1398,36 @@ with st.sidebar:
         accept_multiple_files=True
     )
 
-    doc_text_context = get_uploaded_text(uploaded_files) if uploaded_files else ""
+    # Uploads are keyed by content hash: unchanged files reuse the text kept in
+    # session_state. New files are extracted (and indexed for Document QA) in
+    # the background; only turns that actually need the documents wait for it.
+    files_key = None
+    if uploaded_files:
+        files_key = tuple(hashlib.blake2b(f.getvalue(), digest_size=16).digest() for f in uploaded_files)
+    if st.session_state.doc_key != files_key:
+        st.session_state.doc_key = files_key
+        st.session_state.doc_text_context = ""
+        st.session_state.scanned_files = []
+        st.session_state.doc_future = None
+        if files_key is not None:
+            st.session_state.doc_future = get_background_executor().submit(
+                load_documents, uploaded_files, role == "Document QA"
+            )
+    collect_documents()
+
+    scanned_warning = st.empty()
+    warn_scanned(scanned_warning, st.session_state.scanned_files)
+
+    review_all = False
+    if role == "Resume Review" and uploaded_files and len(uploaded_files) > 1:
+        review_all = st.button("Review all resumes", help="Review each uploaded file as a separate resume.")
 
     st.markdown("### 💾 Chat Controls")
     if st.button("Clear Chat"):
         st.session_state.messages = []
         st.session_state.agent_runs = []
+        st.session_state.history_summary = ""
+        st.session_state.summarized_turns = 0
         st.success("Chat history cleared!")
 
     st.markdown("---")
@@ -390,38 +1480,100 @@ for m in st.session_state.messages:
 # =========================
 user_input = st.chat_input("Type your message or describe a goal...")
 
-if user_input and not api_key:
+if (user_input or batch_texts or review_all) and not api_key:
     st.warning("Please enter your Gemini API key in the sidebar first.")
     st.stop()
 
+if batch_texts and api_key:
+    # ===== BATCH TRANSLATION =====
+    model = init_gemini(api_key)
+    with st.spinner(f"Translating {len(batch_texts)} messages..."):
+        translations = run_async(tool_translate_batch(model, batch_texts, reply_language))
+
+    for text, translation in zip(batch_texts, translations):
+        with st.chat_message("user"):
+            st.markdown(text)
+        with st.chat_message("assistant"):
+            st.markdown(translation)
+        st.session_state.messages.append(
+            {"user": text, "assistant": translation}
+        )
+
+if review_all and api_key:
+    # ===== BULK RESUME REVIEW =====
+    model = init_gemini(api_key)
+    # Once the background job is done, per-file text comes straight from
+    # the extraction cache it filled.
+    wait_for_documents(scanned_warning)
+    resumes = [(f.name, _extract_cached(f.getvalue(), f.name)[0]) for f in uploaded_files]
+    resumes = [(name, text) for name, text in resumes if text.strip()]
+    if not resumes:
+        st.warning("None of the uploaded files has any text to review. Scanned PDFs need OCR first.")
+
+    with st.spinner(f"Reviewing {len(resumes)} resumes..."):
+        for name, review in iterate_async(review_resumes_as_completed(model, resumes, reply_language)):
+            request = f"Review resume: {name}"
+            with st.chat_message("user"):
+                st.markdown(request)
+            with st.chat_message("assistant"):
+                st.markdown(review)
+            st.session_state.messages.append(
+                {"user": request, "assistant": review}
+            )
+
 if user_input and api_key:
     model = init_gemini(api_key)
 
+    # Let the local router pick a tool for open-ended requests.
+    route = None
+    if main_mode != "Chat" or role == "General Assistant":
+        route = route_request(user_input, has_docs=st.session_state.doc_key is not None)
+    chat_role = role
+    if main_mode == "Chat" and role == "General Assistant":
+        chat_role = ROUTE_ROLES.get(route, role)
+
+    doc_text_context = ""
+    if main_mode != "Chat" or chat_role in DOC_ROLES:
+        wait_for_documents(scanned_warning)
+        doc_text_context = st.session_state.doc_text_context
+
     if main_mode == "Chat":
         # ===== NORMAL CHAT MODE =====
         with st.chat_message("user"):
             st.markdown(user_input)
 
-        # Route based on role
-        if role == "General Assistant":
-            assistant_reply = tool_general_chat(model, user_input, reply_language, role, st.session_state.messages)
-        elif role == "Coding Help":
-            assistant_reply = tool_coding_help(model, user_input, reply_language)
-        elif role == "Resume Review":
+        # Route based on role (General Assistant may have been routed above).
+        # A routed coding/emotional turn stays in general chat with the routed
+        # role's tone, so it keeps the conversation ("fix the code above").
+        if chat_role == "General Assistant" or (chat_role != role and chat_role not in DOC_ROLES):
+            roll_history_summary(model)
+            assistant_reply = run_async(tool_general_chat(
+                model, user_input, reply_language, chat_role, recent_history()[-MAX_TURNS:],
+                stream=True, summary=st.session_state.history_summary
+            ))
+        elif chat_role == "Coding Help":
+            assistant_reply = run_async(tool_coding_help(model, user_input, reply_language, stream=True))
+        elif chat_role == "Resume Review":
             # If there is a document, use it as resume text
             resume_text = doc_text_context if doc_text_context else user_input
-            assistant_reply = tool_resume_review(model, resume_text, reply_language)
-        elif role == "Emotional Support":
-            assistant_reply = tool_emotional_support(model, user_input, reply_language)
-        elif role == "Document QA":
-            assistant_reply = tool_document_qa(model, user_input, doc_text_context, reply_language)
-        elif role == "Translator":
-            assistant_reply = tool_translate(model, user_input, reply_language)
+            assistant_reply = run_async(tool_resume_review(model, resume_text, reply_language, stream=True))
+        elif chat_role == "Emotional Support":
+            assistant_reply = run_async(tool_emotional_support(model, user_input, reply_language, stream=True))
+        elif chat_role == "Document QA":
+            assistant_reply = run_async(tool_document_qa(model, user_input, doc_text_context, reply_language, stream=True))
+        elif chat_role == "Translator":
+            assistant_reply = run_async(tool_translate(model, user_input, reply_language, stream=True))
         else:
-            assistant_reply = tool_general_chat(model, user_input, reply_language, role, st.session_state.messages)
+            roll_history_summary(model)
+            assistant_reply = run_async(tool_general_chat(
+                model, user_input, reply_language, role, recent_history()[-MAX_TURNS:],
+                stream=True, summary=st.session_state.history_summary
+            ))
 
         with st.chat_message("assistant"):
-            st.markdown(assistant_reply)
+            if chat_role != role:
+                st.caption(f"Routed to {chat_role}")
+            assistant_reply = render_reply(assistant_reply)
 
         st.session_state.messages.append(
             {"user": user_input, "assistant": assistant_reply}
@@ -432,19 +1584,20 @@ if user_input and api_key:
         with st.chat_message("user"):
             st.markdown(f"**Goal / Task:** {user_input}")
 
-        agent_run = agentic_plan_and_execute(
+        agent_run = run_async(agentic_plan_and_execute(
             model=model,
             goal=user_input,
             role=role,
             language=reply_language,
             doc_text=doc_text_context,
-            chat_history=st.session_state.messages
-        )
-
-        agent_text = agent_run["agentic_explanation"]
+            chat_history=st.session_state.messages,
+            stream=True,
+            route=route
+        ))
 
         with st.chat_message("assistant"):
-            st.markdown(agent_text)
+            agent_text = render_reply(agent_run["agentic_explanation"])
+        agent_run["agentic_explanation"] = agent_text
 
         st.session_state.messages.append(
             {"user": user_input, "assistant": agent_text}